@@ -1,64 +1,179 @@
-import random
-import math
 import streamlit as st
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.ticker import FuncFormatter
+from joblib import Parallel, cpu_count, delayed
+from scipy.signal import fftconvolve
 from sklearn.neighbors import KernelDensity
-from typing import List, Tuple
-
-def bezier_curve(t: float, A: Tuple[float, float], B: Tuple[float, float], C: Tuple[float, float]) -> Tuple[float, float]:
-    """Computes a point on a quadratic Bezier curve given control points A, B, C and a parameter t."""
-    return (
-        (1 - t) ** 2 * A[0] + 2 * (1 - t) * t * C[0] + t**2 * B[0],
-        (1 - t) ** 2 * A[1] + 2 * (1 - t) * t * C[1] + t**2 * B[1],
-    )
+from typing import Tuple, Union
+
+# KDEpy is an optional speed-up and is not listed in requirements.txt; install it
+# separately to evaluate the grid with FFTKDE. Without it, the Gaussian kernel uses
+# scipy's FFT convolution and the other kernels use sklearn.
+try:
+    from KDEpy import FFTKDE
+except ImportError:
+    FFTKDE = None
+
+X_MIN, X_MAX = -5, 15
+Y_MIN, Y_MAX = -5, 15
+
+# Densities below this fraction of the peak are treated as zero, which keeps FFT
+# round-off out of the log-density.
+DENSITY_FLOOR = 1e-8
+
+# How many nats below the peak log-density the heatmap and isolines cover.
+LOG_DENSITY_RANGE = 10
+
+# sklearn kernel names mapped to their KDEpy equivalents.
+FFTKDE_KERNELS = {
+    "linear": "tri",
+    "epanechnikov": "epa",
+    "tophat": "box",
+    "gaussian": "gaussian",
+    "exponential": "exponential",
+    "cosine": "cosine",
+}
+
+# KDEpy scales every kernel to unit variance, while sklearn's bandwidth is the support
+# radius of compact kernels and the scale of the exponential. Dividing the sklearn
+# bandwidth by these factors gives the matching KDEpy bw (the compact kernels' factor
+# is KDEpy's kernel support at bw=1; a unit-variance Laplace has scale 1/sqrt(2)).
+FFTKDE_BW_SCALE = {
+    "linear": np.sqrt(6),
+    "epanechnikov": np.sqrt(5),
+    "tophat": np.sqrt(3),
+    "gaussian": 1.0,
+    "exponential": 1 / np.sqrt(2),
+    "cosine": 1 / np.sqrt(1 - 8 / np.pi**2),
+}
+
+def bernstein_basis(t: Union[float, np.ndarray]) -> np.ndarray:
+    """Computes the (N, 3) quadratic Bernstein basis (1 - t)^2, 2(1 - t)t, t^2 for a scalar or array parameter t."""
+    t = np.atleast_1d(t)
+    omt = 1 - t
+    return np.stack([omt * omt, 2 * omt * t, t * t], axis=1)
 
 @st.cache_data
-def generate_points_around_line(a: Tuple[float, float], b: Tuple[float, float], c: Tuple[float, float], num_points: int, max_distance: float) -> List[Tuple[float, float]]:
-    """Generates a set of random points around a Bezier curve defined by points a, b, c."""
-    points = []
-    for _ in range(num_points):
-        t = random.uniform(0, 1)
-        point_on_curve = bezier_curve(t, a, b, c)
+def curve_basis(n: int = 100) -> np.ndarray:
+    """Computes the Bernstein basis for n evenly spaced parameters, used to draw the curve."""
+    return bernstein_basis(np.linspace(0, 1, n, dtype=np.float32))
 
-        theta = random.uniform(0, 2 * math.pi)
-        dx = max_distance * math.cos(theta)
-        dy = max_distance * math.sin(theta)
+def bezier_curve(basis: np.ndarray, A: Tuple[float, float], B: Tuple[float, float], C: Tuple[float, float]) -> np.ndarray:
+    """Computes an (N, 2) array of points on a quadratic Bezier curve from a precomputed Bernstein basis and control points A, B, C."""
+    P = np.array([A, C, B], dtype=np.result_type(basis, np.float32))
+    return basis @ P
 
-        new_point = (point_on_curve[0] + dx, point_on_curve[1] + dy)
-        points.append(new_point)
+@st.cache_data
+def bezier_polyline(a: Tuple[float, float], b: Tuple[float, float], c: Tuple[float, float], n: int = 100) -> np.ndarray:
+    """Samples an (n, 2) array of points along the Bezier curve defined by points a, b, c."""
+    return bezier_curve(curve_basis(n), a, b, c)
 
+@st.cache_data
+def generate_points_around_line(a: Tuple[float, float], b: Tuple[float, float], c: Tuple[float, float], num_points: int, max_distance: float) -> np.ndarray:
+    """Generates an (N, 2) float32 array of random points around a Bezier curve defined by points a, b, c."""
+    # Draw the curve parameters and the offset angles in a single RNG call.
+    t, theta = np.random.default_rng().random((2, num_points), dtype=np.float32)
+    points = bezier_curve(bernstein_basis(t), a, b, c)
+
+    theta *= 2 * np.pi
+    points += max_distance * np.column_stack([np.cos(theta), np.sin(theta)])
     return points
 
-def plot_kde(points: List[Tuple[float, float]], kernel: str, bandwidth: float, a: Tuple[float, float], b: Tuple[float, float], c: Tuple[float, float]) -> None:
-    """Plots the KDE and Bezier curve."""
-    x_coords = [point[0] for point in points]
-    y_coords = [point[1] for point in points]
+def gaussian_kernel_2d(bandwidth: float, dx: float, dy: float) -> np.ndarray:
+    """Samples an isotropic Gaussian with standard deviation bandwidth on a grid with spacing dx, dy, normalized to sum to 1."""
+    rx = int(np.ceil(4 * bandwidth / dx))
+    ry = int(np.ceil(4 * bandwidth / dy))
+    gx = np.arange(-rx, rx + 1) * dx
+    gy = np.arange(-ry, ry + 1) * dy
+    g = np.exp(-0.5 * (gy[:, None] ** 2 + gx[None, :] ** 2) / bandwidth**2)
+    return g / g.sum()
 
-    fig, ax = plt.subplots(figsize=(10, 10))
-
-    kde = KernelDensity(kernel=kernel, bandwidth=bandwidth).fit(points)
-    x_min, x_max = -5, 15
-    y_min, y_max = -5, 15
-    x = np.linspace(x_min, x_max, 500)
-    y = np.linspace(y_min, y_max, 500)
+@st.cache_data
+def evaluate_kde(points_bytes: bytes, kernel: str, bandwidth: float, n: int = 200) -> np.ndarray:
+    """Fits a KDE to the serialized (N, 2) float32 points and returns its log-density on an n x n grid."""
+    points = np.frombuffer(points_bytes, dtype=np.float32).reshape(-1, 2)
+    x = np.linspace(X_MIN, X_MAX, n, dtype=np.float32)
+    y = np.linspace(Y_MIN, Y_MAX, n, dtype=np.float32)
+
+    if FFTKDE is not None:
+        # FFTKDE bins the data onto the equispaced grid and convolves via FFT, so the
+        # cost does not grow with the number of points. The grid must be sorted with
+        # the first coordinate varying slowest, hence the transpose back to (y, x).
+        grid = np.column_stack([np.repeat(x, n), np.tile(y, n)])
+        bw = bandwidth / FFTKDE_BW_SCALE[kernel]
+        Z = FFTKDE(kernel=FFTKDE_KERNELS[kernel], bw=bw).fit(points).evaluate(grid)
+        Z = np.where(Z > Z.max() * DENSITY_FLOOR, Z, 0)
+        with np.errstate(divide="ignore"):
+            return np.log(Z.reshape(n, n).T)
+
+    if kernel == "gaussian":
+        # Bin the points onto the grid cells and blur the counts with a sampled Gaussian;
+        # like FFTKDE this costs O(M log M) in the grid size regardless of the point count.
+        dx = (X_MAX - X_MIN) / (n - 1)
+        dy = (Y_MAX - Y_MIN) / (n - 1)
+        x_edges = np.linspace(X_MIN - dx / 2, X_MAX + dx / 2, n + 1)
+        y_edges = np.linspace(Y_MIN - dy / 2, Y_MAX + dy / 2, n + 1)
+        H, _, _ = np.histogram2d(points[:, 1], points[:, 0], bins=[y_edges, x_edges])
+        Z = fftconvolve(H, gaussian_kernel_2d(bandwidth, dx, dy), mode="same") / (len(points) * dx * dy)
+        # The convolution round-off is signed, so this also removes negative values.
+        Z = np.where(Z > Z.max() * DENSITY_FLOOR, Z, 0)
+        with np.errstate(divide="ignore"):
+            return np.log(Z)
+
+    # A relative tolerance lets the tree prune nodes whose contribution is small
+    # compared to the density itself, which stays accurate in log space.
+    kde = KernelDensity(kernel=kernel, bandwidth=bandwidth, rtol=1e-3).fit(points)
     X, Y = np.meshgrid(x, y)
     xy = np.vstack([X.ravel(), Y.ravel()]).T
-    Z = np.exp(kde.score_samples(xy)).reshape(X.shape)
-    ax.contour(X, Y, Z, levels=np.linspace(Z.min(), Z.max(), 100), cmap="Blues")
+    # Scoring is independent per query point, so evaluate row-bands of the grid in parallel.
+    bands = np.array_split(xy, cpu_count())
+    scores = Parallel(n_jobs=-1, backend="loky")(delayed(kde.score_samples)(band) for band in bands)
+    return np.concatenate(scores).reshape(X.shape)
+
+def plot_kde(points: np.ndarray, kernel: str, bandwidth: float, a: Tuple[float, float], b: Tuple[float, float], c: Tuple[float, float], grid_size: int = 200) -> None:
+    """Plots the KDE and Bezier curve."""
+    x_coords = points[:, 0]
+    y_coords = points[:, 1]
+
+    # Reuse one figure across reruns instead of building a new canvas on every slider move.
+    if "fig" not in st.session_state:
+        st.session_state.fig, (st.session_state.ax, st.session_state.cax) = plt.subplots(
+            1, 2, figsize=(10, 10), gridspec_kw={"width_ratios": [20, 1]}
+        )
+    fig, ax, cax = st.session_state.fig, st.session_state.ax, st.session_state.cax
+    ax.clear()
+    cax.clear()
+
+    x = np.linspace(X_MIN, X_MAX, grid_size, dtype=np.float32)
+    y = np.linspace(Y_MIN, Y_MAX, grid_size, dtype=np.float32)
+    # Plot the log-density directly; grid points with zero density (outside a compact
+    # kernel's support or below the FFT round-off floor) give -inf, which is masked out.
+    # The far tail can span hundreds of nats, so the colour range and isolines are bounded
+    # to LOG_DENSITY_RANGE below the peak rather than running down to the minimum.
+    logZ = np.ma.masked_invalid(evaluate_kde(points.tobytes(), kernel, bandwidth, grid_size))
+    vmax = logZ.max()
+    vmin = vmax - LOG_DENSITY_RANGE
+    # imshow's extent is the outer pixel edges, so pad by half a grid step to put each
+    # pixel centre on its sample and line up with the contour overlay.
+    dx = (X_MAX - X_MIN) / (grid_size - 1)
+    dy = (Y_MAX - Y_MIN) / (grid_size - 1)
+    extent = (X_MIN - dx / 2, X_MAX + dx / 2, Y_MIN - dy / 2, Y_MAX + dy / 2)
+    image = ax.imshow(logZ, extent=extent, origin="lower", cmap="Blues", aspect="auto", interpolation="bilinear", vmin=vmin, vmax=vmax)
+    ax.contour(x, y, logZ, levels=np.linspace(vmin, vmax, 8), colors="navy", linewidths=0.5)
+    # Only the colorbar ticks are mapped back to density, not the whole grid.
+    fig.colorbar(image, cax=cax, label="Density", format=FuncFormatter(lambda value, _: f"{np.exp(value):.2g}"))
 
     ax.scatter(x_coords, y_coords, c="blue", marker="o", label="Generated Points", zorder=3)
-    t_values = np.linspace(0, 1, 100)
-    x_bezier = [bezier_curve(t, a, b, c)[0] for t in t_values]
-    y_bezier = [bezier_curve(t, a, b, c)[1] for t in t_values]
-    ax.plot(x_bezier, y_bezier, color="red", linewidth=2, label="Bezier Curve", zorder=3)
+    curve = bezier_polyline(a, b, c)
+    ax.plot(curve[:, 0], curve[:, 1], color="red", linewidth=2, label="Bezier Curve", zorder=3)
 
     ax.legend()
     ax.set_xlabel("X")
     ax.set_ylabel("Y")
     ax.grid(True)
 
-    st.pyplot(fig)
+    st.pyplot(fig, clear_figure=False)
 
 def main() -> None:
     """Main function that sets up Streamlit interface and calls relevant functions to plot."""
@@ -78,13 +193,14 @@ def main() -> None:
     c_y = st.sidebar.slider("C Y-coordinate", min_value=0.0, max_value=10.0, value=8.0)
     num_points = st.sidebar.slider("Number of Points", min_value=10, max_value=500, value=100)
     max_dist = st.sidebar.slider("Maximum Distance", min_value=0.05, max_value=2.0, value=1.0)
+    grid_size = st.sidebar.slider("Grid Resolution", min_value=50, max_value=500, value=200, step=50)
 
     a = (a_x, a_y)
     b = (b_x, b_y)
     c = (c_x, c_y)
 
     points = generate_points_around_line(a, b, c, num_points, max_dist)
-    plot_kde(points, kernel, bandwidth, a, b, c)
+    plot_kde(points, kernel, bandwidth, a, b, c, grid_size)
 
 if __name__ == "__main__":
     main()